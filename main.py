@@ -1,13 +1,15 @@
+import hashlib
+import html
+import itertools
 import json
 import mimetypes
 import os
 import pathlib
 import re
 import shutil
-import tempfile
+import string
+import time
 import typing
-import uuid
-import xml.dom.minidom
 
 import anki.cards
 import anki.media
@@ -25,18 +27,52 @@ VIDEO_EXTS: typing.Final[list[str]] = [
     '.webm',
 ]
 
+VIDEO_MIMES: typing.Final[dict[str, str]] = {
+    ext: (
+        mimetypes.guess_type('x' + ext, strict=False)[0]
+        or f'video/{ext.lstrip(".")}')
+    for ext in VIDEO_EXTS
+}
+
+MEDIA_PREFIX: typing.Final[str] = 'anki-video-'
+
+# uuid4 names are from older versions, keep matching them
 MEDIA_REGEXP: typing.Pattern = re.compile(
-    r'anki-video-'
-    + r'[a-fA-F0-9]{8}' \
+    r'^anki-video-'
+    + r'(?:[a-fA-F0-9]{8}' \
     + r'-[a-fA-F0-9]{4}' \
     + r'-[a-fA-F0-9]{4}' \
     + r'-[a-fA-F0-9]{4}' \
     + r'-[a-fA-F0-9]{12}' \
-    + r'\..*')
+    + r'|[a-fA-F0-9]+)' \
+    + r'\.[^.]+$')
+
+_HEX_DIGITS: typing.Final[frozenset[str]] = frozenset(string.hexdigits)
+
+SIZE_REGEXP: typing.Pattern = re.compile(
+    r'^\s*([0-9]+)(?:\s*px\s*)?' \
+    + r'[x\s,:\-/\\]+' \
+    + r'([0-9]+)(?:\s*px\s*)?\s*$', re.IGNORECASE)
 
 ROOT_DIR: typing.Final[pathlib.Path] = pathlib.Path(__file__).parent.absolute()
 ELEMENT_CLASS: typing.Final[str] = "anki-video"
 
+VIDEO_HTML: typing.Final[str] = (
+    '<video id="{uid}" class="video-js ' + ELEMENT_CLASS + '"' \
+    + ' controls="true" preload="auto">' \
+    + '<source src="{src}" type="{mime}"></source>' \
+    + '{assets}' \
+    + '{options}' \
+    + '</video>')
+
+# prevents Anki from deleting file when checking media
+# https://github.com/ankitects/anki/blob/
+#   ae6a03942f651790c40f8d8479f90eb7715bf2af/
+#   rslib/src/text.rs#L104
+ASSET_HTML: typing.Final[str] = '<object hidden="true" src="{src}"></object>'
+
+OPTION_HTML: typing.Final[str] = '<config option="{option}">null</config>'
+
 Config = typing.TypedDict(
     'Config', {
         "clipboard paste": bool,
@@ -64,6 +100,91 @@ assert aqt.mw, 'no main window found'
 config: Config = DEFAULT_CONFIG \
     | (aqt.mw.addonManager.getConfig(__name__) or {}) # type: ignore
 
+_ADDON_PKG: typing.Final[str] = aqt.mw.addonManager.addonFromModule(__name__)
+WEB_CSS: typing.Final[list[str]] = [
+    f"/_addons/{_ADDON_PKG}/video-js.css",
+]
+WEB_JS: typing.Final[list[str]] = [
+    f"/_addons/{_ADDON_PKG}/video.js",
+]
+
+
+def _fast_copy(
+    src: typing.Union[str, pathlib.Path],
+    dest: typing.Union[str, pathlib.Path],
+):
+    with open(src, 'rb') as fsrc, open(dest, 'wb') as fdest:
+        infd, outfd = fsrc.fileno(), fdest.fileno()
+        size = os.fstat(infd).st_size
+        copied = 0
+
+        # in-kernel copy, reflinks on filesystems that support it
+        if hasattr(os, 'copy_file_range'):
+            try:
+                while copied < size and (n := os.copy_file_range(
+                        infd, outfd, size - copied, copied, copied)) > 0:
+                    copied += n
+            except OSError:
+                pass
+
+        if copied < size and hasattr(os, 'sendfile'):
+            try:
+                # sendfile() writes at the current position, which the
+                # explicit offsets above never moved
+                os.lseek(outfd, copied, os.SEEK_SET)
+                while copied < size:
+                    n = os.sendfile(outfd, infd, copied, size - copied)
+                    if n <= 0:
+                        break
+                    copied += n
+            except OSError:
+                pass
+
+        if copied < size:
+            fsrc.seek(copied)
+            fdest.seek(copied)
+            shutil.copyfileobj(fsrc, fdest, 1024 * 1024)
+
+
+# media names only need to be unique, not unguessable
+_uid_counter: typing.Iterator[int] = itertools.count(time.time_ns() // 1000000)
+
+
+def _next_uid() -> str:
+    return f"{next(_uid_counter):x}{os.urandom(4).hex()}"
+
+
+def _is_managed(name: str) -> bool:
+    # MEDIA_REGEXP is the source of truth; this is a faster equivalent,
+    # tests/test_main.py checks the two agree
+    if not name.startswith(MEDIA_PREFIX):
+        return False
+
+    uid, dot, ext = name[len(MEDIA_PREFIX):].partition('.')
+    if not dot or not ext or '.' in ext:
+        return False
+
+    if len(uid) == 36 and uid.count('-') == 4 \
+    and all(uid[i] == '-' for i in (8, 13, 18, 23)):
+        uid = uid.replace('-', '')
+    return len(uid) > 0 and all(c in _HEX_DIGITS for c in uid)
+
+
+# session memo of imported sources, so re-dropping a file reuses its media
+_imported: dict[tuple, pathlib.Path] = {}
+
+
+def _file_key(file: pathlib.Path) -> tuple[int, int, bytes]:
+    chunk = 64 * 1024
+    stat = file.stat()
+    digest = hashlib.blake2b(digest_size=16)
+    with file.open('rb') as f:
+        digest.update(f.read(chunk))
+        if stat.st_size > chunk:
+            f.seek(max(chunk, stat.st_size - chunk))
+            digest.update(f.read(chunk))
+    return stat.st_size, stat.st_mtime_ns, digest.digest()
+
 
 def _import_file_async(
     editor: aqt.editor.EditorWebView,
@@ -85,13 +206,35 @@ def _import_file_async(
             dest = pathlib.Path(dest)
 
         dest.parent.mkdir(parents=True, exist_ok=True)
-        with tempfile.TemporaryDirectory(prefix="anki-video-") as tmpdir:
-            tmpfile = pathlib.Path(tmpdir, dest.name)
-            shutil.copyfile(src, tmpfile)
-            tmpfile.rename(dest)
-
-    uid = str(uuid.uuid4())
-    dest = media_dir / f"anki-video-{uid}{file.suffix.lower()}"
+        try:
+            # same filesystem, so share the data instead of copying it
+            os.link(src, dest)
+            return
+        except OSError:
+            pass  # cross-device or unsupported, fall back to a copy
+
+        # same directory as dest so the final rename is atomic
+        tmpfile = dest.with_name(dest.name + '.part')
+        try:
+            _fast_copy(src, tmpfile)
+            os.replace(tmpfile, dest)
+        except BaseException:
+            tmpfile.unlink(missing_ok=True)
+            raise
+
+    # uid is also the element id, so it stays unique even for duplicates
+    uid = _next_uid()
+    if _is_managed(file.name) and file.parent.resolve() == media_dir.resolve():
+        return uid, file
+
+    try:
+        key = (media_dir, *_file_key(file))
+    except OSError:
+        key = None
+    if key and (dest := _imported.get(key)) and dest.exists():
+        return uid, dest
+
+    dest = media_dir / f"{MEDIA_PREFIX}{uid}{file.suffix.lower()}"
     op = aqt.operations.QueryOp(
         parent=aqt.mw,
         op=lambda col: copy_file(file, dest),
@@ -99,56 +242,28 @@ def _import_file_async(
     )
 
     op.without_collection().run_in_background()
+    if key:
+        _imported[key] = dest
     return uid, dest
 
 
-def _on_webview_will_set_content(
-        web_content: aqt.webview.WebContent, context: typing.Optional[object]):
-    if not isinstance(context,
-                      (aqt.reviewer.Reviewer, aqt.previewer.BrowserPreviewer)):
-        return
-
-    assert aqt.mw, 'no main window'
-    pkg = aqt.mw.addonManager.addonFromModule(__name__)
-    config = DEFAULT_CONFIG | (aqt.mw.addonManager.getConfig(__name__) or {})
-
-    web_content.css.append(f"/_addons/{pkg}/video-js.css")
-    web_content.js.append(f"/_addons/{pkg}/video.js")
-
-    autoresize = False
-    width = -1
-    height = -1
-    if (size := config.get('size')) and isinstance(size, str):
-        if (m := re.match(r'^\s*([0-9]+)(?:\s*px\s*)?' + r'[x\s,:\-/\\]+'
-                          + r'([0-9]+)(?:\s*px\s*)?\s*$', size, re.IGNORECASE)):
-            autoresize = False
-            width = int(m.group(1))
-            height = int(m.group(2))
-        elif size.lower() in ['auto']:
-            autoresize = True
-        elif size.lower() in ['default']:
-            autoresize = False
-
-    web_content.head += f'<script type="text/javascript">\n'
-    web_content.head += f"""
+# collapsed to one line, it is sent with every card
+PLAYER_JS: typing.Final[str] = re.sub(
+    r'\s+', ' ', f"""
         var _ankiVideoUpdate = function() {{
             const els = document.querySelectorAll(".{ELEMENT_CLASS}");
             els.forEach((el) => {{
+                const defaults = _ankiVideoConfig;
                 var opts = {{}};
-                opts.loop = {'true'
-                    if config.get('loop', True) else 'false'};
-                opts.mute = {'true'
-                    if config.get('mute', False) else 'false'};
-                opts.controls = {'true'
-                    if config.get('controls', True) else 'false'};
-                opts.autoplay = {'true'
-                    if config.get('autoplay', True) else 'false'};
-                opts.volume = {config['volume']
-                    if config.get('volume') is not None else 'null'};
-
-                if ({width} >= 0 && {height} >= 0) {{
-                    opts.width = {width};
-                    opts.height = {height};
+                opts.loop = defaults.loop;
+                opts.mute = defaults.mute;
+                opts.controls = defaults.controls;
+                opts.autoplay = defaults.autoplay;
+                opts.volume = defaults.volume;
+
+                if (defaults.width >= 0 && defaults.height >= 0) {{
+                    opts.width = defaults.width;
+                    opts.height = defaults.height;
                 }}
 
                 el.querySelectorAll("config").forEach((optEl) => {{
@@ -199,7 +314,7 @@ def _on_webview_will_set_content(
                 args.muted = opts.mute;
                 args.controls = opts.controls;
                 args.disablePictureInPicture = true;
-                args.fluid = {'true' if autoresize else 'false'};
+                args.fluid = defaults.fluid;
 
                 if (typeof opts.width === "number" && opts.width >= 0) {{
                     args.width = opts.width;
@@ -215,7 +330,7 @@ def _on_webview_will_set_content(
                     this.playsinline(true);
 
                     if (typeof opts.volume === "number" && opts.volume >= 0) {{
-                        this.volume(Math.max(0.0, Math.min(1.0, opts.volume)))
+                        this.volume(Math.max(0.0, Math.min(1.0, opts.volume)));
                     }}
 
                     if (opts.autoplay) {{
@@ -223,7 +338,7 @@ def _on_webview_will_set_content(
                     }}
                 }});
             }});
-        }}
+        }};
 
         if (typeof onUpdateHook !== 'undefined') {{
             onUpdateHook.push(_ankiVideoUpdate);
@@ -241,8 +356,69 @@ def _on_webview_will_set_content(
             subtree: true,
             childList: true,
         }});
-        """
-    web_content.head += '</script>\n'
+        """).strip()
+
+_head_html: typing.Optional[str] = None
+
+
+def _on_config_updated(new_config: typing.Optional[dict]):
+    global config, _head_html
+    config = DEFAULT_CONFIG | (new_config or {})  # type: ignore
+    _head_html = None
+
+
+def _parse_size(size: typing.Optional[str]) -> tuple[bool, int, int]:
+    autoresize = False
+    width = -1
+    height = -1
+    if size and isinstance(size, str):
+        if (m := SIZE_REGEXP.match(size)):
+            autoresize = False
+            width = int(m.group(1))
+            height = int(m.group(2))
+        elif size.lower() in ['auto']:
+            autoresize = True
+        elif size.lower() in ['default']:
+            autoresize = False
+    return autoresize, width, height
+
+
+def _build_head_html(config: Config) -> str:
+    autoresize, width, height = _parse_size(config.get('size'))
+
+    opts = {
+        'loop': bool(config.get('loop', True)),
+        'mute': bool(config.get('mute', False)),
+        'controls': bool(config.get('controls', True)),
+        'autoplay': bool(config.get('autoplay', True)),
+        'volume': config.get('volume'),
+        'width': width,
+        'height': height,
+        'fluid': autoresize,
+    }
+
+    # player script is static; only this small options object varies
+    result = '<script type="text/javascript">\n'
+    result += f'var _ankiVideoConfig = {json.dumps(opts)};\n'
+    result += PLAYER_JS + '\n'
+    result += '</script>\n'
+    return result
+
+
+def _on_webview_will_set_content(
+        web_content: aqt.webview.WebContent, context: typing.Optional[object]):
+    global _head_html
+    if not isinstance(context,
+                      (aqt.reviewer.Reviewer, aqt.previewer.BrowserPreviewer)):
+        return
+
+    web_content.css.extend(WEB_CSS)
+    web_content.js.extend(WEB_JS)
+
+    # config only changes through the addon manager, so render once
+    if _head_html is None:
+        _head_html = _build_head_html(config)
+    web_content.head += _head_html
 
 
 def _qurl_ext(url: aqt.qt.QUrl) -> str:
@@ -272,48 +448,25 @@ def _on_editor_will_process_mime(
         file = pathlib.Path(url.toLocalFile())
         uid, videofile = _import_file_async(editor, file)
 
-        doc = xml.dom.minidom.Document()
-
-        video = doc.createElement('video')
-        video.setAttribute('id', uid)
-        video.setAttribute('class', ' '.join([ 'video-js', ELEMENT_CLASS ]))
-        video.setAttribute('controls', 'true')
-        video.setAttribute('preload', 'auto')
-        doc.appendChild(video)
-
-        # empty text child node to prevent Anki's inserthtml() mangling
-
-        source = doc.createElement('source')
-        source.setAttribute('src', videofile.name)
-        source.setAttribute(
-            'type',
-            mimetypes.guess_type(videofile, strict=False)[0] or '')
-        source.appendChild(doc.createTextNode(''))
-        video.appendChild(source)
-
-        for asset in [videofile.name]:
-            # prevents Anki from deleting file when checking media
-            # https://github.com/ankitects/anki/blob/
-            #   ae6a03942f651790c40f8d8479f90eb7715bf2af/
-            #   rslib/src/text.rs#L104
-            el = doc.createElement('object')
-            el.setAttribute('hidden', 'true')
-            el.setAttribute('src', asset)
-            el.appendChild(doc.createTextNode(''))
-            video.appendChild(el)
-
-        for opt in [ 'autoplay', 'loop', 'controls', 'mute', 'volume']:
-            el = doc.createElement('config')
-            el.setAttribute('option', opt)
-            el.appendChild(doc.createTextNode('null'))
-            video.appendChild(el)
-
-        htmls.append(video.toprettyxml(indent='    '))
-
-    html = '\n'.join(htmls)
+        # explicit end tags to prevent Anki's inserthtml() mangling
+        htmls.append(
+            VIDEO_HTML.format(
+                uid=html.escape(uid, quote=True),
+                src=html.escape(videofile.name, quote=True),
+                mime=html.escape(
+                    VIDEO_MIMES.get(videofile.suffix.lower(), ''), quote=True),
+                assets=''.join(
+                    ASSET_HTML.format(src=html.escape(asset, quote=True))
+                    for asset in [videofile.name]),
+                options=''.join(
+                    OPTION_HTML.format(option=opt) for opt in
+                    [ 'autoplay', 'loop', 'controls', 'mute', 'volume']),
+            ))
+
+    result = '\n'.join(htmls)
     editor.eval(
         f"""(function () {{
-        let html = {json.dumps(html)};
+        let html = {json.dumps(result)};
         if (html !== "") {{
             setFormat("inserthtml", html)
         }}
@@ -330,6 +483,7 @@ def _on_editor_will_show_context_menu(
 def init_addon():
     assert aqt.mw, 'no main window'
     aqt.mw.addonManager.setWebExports(__name__, r".*\.(css|js|bmp|png)")
+    aqt.mw.addonManager.setConfigUpdatedAction(__name__, _on_config_updated)
     # aqt.gui_hooks.editor_will_show_context_menu.append(
     #     _on_editor_will_show_context_menu)
     aqt.gui_hooks.editor_will_process_mime.append(_on_editor_will_process_mime)
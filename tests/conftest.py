@@ -0,0 +1,72 @@
+import pathlib
+import sys
+import types
+
+ROOT_DIR = pathlib.Path(__file__).parent.parent.absolute()
+sys.path.insert(0, str(ROOT_DIR))
+
+_STUB_MODULES: list[str] = [
+    'anki',
+    'anki.cards',
+    'anki.media',
+    'aqt',
+    'aqt.editor',
+    'aqt.gui_hooks',
+    'aqt.previewer',
+    'aqt.operations',
+    'aqt.qt',
+    'aqt.reviewer',
+    'aqt.utils',
+    'aqt.webview',
+]
+
+
+class _AddonManager:
+    def getConfig(self, module: str):
+        return None
+
+    def addonFromModule(self, module: str) -> str:
+        return module.split('.')[0]
+
+    def setWebExports(self, module: str, pattern: str):
+        pass
+
+    def setConfigUpdatedAction(self, module: str, func):
+        pass
+
+
+def _install_anki_stubs():
+    # main.py needs a running Anki at import; outside of Anki, provide the
+    # few names it touches at module level
+    try:
+        import aqt  # noqa: F401
+        return
+    except ImportError:
+        pass
+
+    for name in _STUB_MODULES:
+        sys.modules[name] = types.ModuleType(name)
+        parent, _, child = name.rpartition('.')
+        if parent:
+            setattr(sys.modules[parent], child, sys.modules[name])
+
+    # referenced by annotations, which are evaluated at def time
+    for module, attr in [
+        ('aqt.editor', 'EditorWebView'),
+        ('aqt.qt', 'QMenu'),
+        ('aqt.qt', 'QMimeData'),
+        ('aqt.qt', 'QUrl'),
+        ('aqt.webview', 'WebContent'),
+    ]:
+        setattr(sys.modules[module], attr, type(attr, (), {}))
+
+    # pytest imports the add-on package itself, which runs init_addon()
+    for hook in [ 'editor_will_process_mime', 'webview_will_set_content']:
+        setattr(sys.modules['aqt.gui_hooks'], hook, [])
+
+    setattr(
+        sys.modules['aqt'], 'mw',
+        types.SimpleNamespace(addonManager=_AddonManager()))
+
+
+_install_anki_stubs()
@@ -0,0 +1,85 @@
+import errno
+import os
+import pathlib
+import random
+
+import pytest
+
+import main
+
+
+def _partial_copy_file_range(limit: int):
+    calls = []
+
+    def copy_file_range(infd, outfd, count, offset_src, offset_dst):
+        # copy up to limit bytes like the real syscall, then fail
+        if calls:
+            raise OSError(errno.EXDEV, os.strerror(errno.EXDEV))
+        calls.append(count)
+        data = os.pread(infd, min(count, limit), offset_src)
+        return os.pwrite(outfd, data, offset_dst)
+
+    return copy_file_range
+
+
+@pytest.mark.parametrize('sendfile', [ True, False ])
+def test_fast_copy_resumes_after_partial_copy_file_range(
+    tmp_path: pathlib.Path,
+    monkeypatch: pytest.MonkeyPatch,
+    sendfile: bool,
+):
+    src = tmp_path / 'src.bin'
+    dest = tmp_path / 'dest.bin'
+    src.write_bytes(os.urandom(3*1024*1024 + 7))
+
+    monkeypatch.setattr(
+        os,
+        'copy_file_range',
+        _partial_copy_file_range(1024 * 1024),
+        raising=False)
+    if not sendfile:
+        monkeypatch.delattr(os, 'sendfile', raising=False)
+
+    main._fast_copy(src, dest)
+    assert dest.read_bytes() == src.read_bytes()
+
+
+def test_fast_copy_empty_file(tmp_path: pathlib.Path):
+    src = tmp_path / 'src.bin'
+    dest = tmp_path / 'dest.bin'
+    src.write_bytes(b'')
+
+    main._fast_copy(src, dest)
+    assert dest.read_bytes() == b''
+
+
+@pytest.mark.parametrize(
+    'name', [
+        'anki-video-1a2b3c.webm',
+        'anki-video-12345678-1234-1234-1234-123456789abc.webm',
+        'anki-video-aaaaaaaa-aaaa-aaaa-aaaa-aaaaaaaaaa--.webm',
+        'anki-video-aaaa-aaaa-aaaa-aaaa-aaaaaaaaaaaaaaaa.webm',
+        'anki-video-x.webm',
+        'anki-video-1a.webm.part',
+        'anki-video-.webm',
+        'anki-video-1a.',
+        'anki-video-1a',
+        'foo.webm',
+    ])
+def test_is_managed_matches_media_regexp(name: str):
+    assert main._is_managed(name) \
+        == (main.MEDIA_REGEXP.fullmatch(name) is not None)
+
+
+def test_is_managed_matches_media_regexp_random():
+    rng = random.Random(0)
+    legacy = '12345678-1234-1234-1234-123456789abc'
+    for _ in range(50000):
+        # mutate a legacy id so hyphens land in and out of place
+        uid = list(legacy if rng.random() < 0.8 else legacy[:rng.randrange(36)])
+        for _ in range(rng.randint(1, 3)):
+            if uid:
+                uid[rng.randrange(len(uid))] = rng.choice('a1-.x')
+        name = f'{main.MEDIA_PREFIX}{"".join(uid)}.webm'
+        assert main._is_managed(name) \
+            == (main.MEDIA_REGEXP.fullmatch(name) is not None), name